@@ -5,30 +5,82 @@ Fills in cruise time range, cruise name, and sets the dashboard UID to the
 cruise name.
 """
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from pathlib import Path
 import json
+import mmap
+import os
+import re
 import sys
 from typing import Any
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RFC3339_RE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})[Tt](\d{2}):(\d{2}):(\d{2})(?:\.\d+)?(?:[Zz]|[+-](\d{2}):(\d{2}))",
+    re.ASCII
+)
+
+
+def is_rfc3339(stamp: str) -> bool:
+    # Regex checks the format, datetime checks field ranges
+    m = RFC3339_RE.fullmatch(stamp)
+    if m is None:
+        return False
+    year, month, day, hour, minute, second, off_hour, off_minute = (int(g or 0) for g in m.groups())
+    if off_hour > 23 or off_minute > 59:
+        return False
+    if second == 60:
+        # RFC3339 allows leap seconds, datetime does not
+        second = 59
+    try:
+        datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return False
+    return True
+
+
 def read_date_range(tsdata: Path | str) -> tuple[str, str]:
-    min_stamp, max_stamp = "", ""
-    with Path(tsdata).open() as fh:
-        for i, line in enumerate(fh):
-            if i > 6:
-                # Skip first six lines (header section)
-                # First column is always an RFC3339 timestamp
-                # Can get min/max lexicographically, no timestamp parsing necessary
-                fields = line.split("\t")
-                if not fields:
+    min_stamp, max_stamp = b"", b""
+    with Path(tsdata).open("rb") as fh:
+        # mmap refuses to map an empty file
+        if fh.seek(0, 2) == 0:
+            raise ValueError(f"No data found in {tsdata}")
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            # Skip header section (first seven lines) by jumping newline to
+            # newline rather than visiting each header line.
+            pos = 0
+            for _ in range(7):
+                nl = mm.find(b"\n", pos)
+                if nl == -1:
                     raise ValueError(f"No data found in {tsdata}")
-                if len(fields) >= 1:
-                    stamp = fields[0]
+                pos = nl + 1
+            while pos < size:
+                nl = mm.find(b"\n", pos)
+                if nl == -1:
+                    nl = size
+                if nl > pos:
+                    # First column is always an RFC3339 timestamp
+                    # Can get min/max lexicographically, no timestamp parsing necessary
+                    tab = mm.find(b"\t", pos, nl)
+                    stamp = mm[pos:tab if tab != -1 else nl].rstrip(b"\r")
                     if not min_stamp or stamp < min_stamp:
                         min_stamp = stamp
                     if not max_stamp or stamp > max_stamp:
                         max_stamp = stamp
+                pos = nl + 1
     if not min_stamp or not max_stamp:
         raise ValueError(f"Could not determine date range in {tsdata}")
+    # Only validate the returned range, not every row, to keep the scan cheap
+    min_stamp, max_stamp = min_stamp.decode(), max_stamp.decode()
+    for stamp in (min_stamp, max_stamp):
+        if not is_rfc3339(stamp):
+            raise ValueError(f"Invalid RFC3339 timestamp in {tsdata}: {stamp}")
     return (min_stamp, max_stamp)
 
 
@@ -39,16 +91,44 @@ def replace_time_range(dash: dict[Any, Any], from_time: str, to_time: str):
 
 def replace_cruise(dash: dict[Any, Any], cruise):
     dash["title"] = dash["title"].replace("CRUISE", cruise)
-    for template_vars in dash["templating"]["list"]:
-        if template_vars["name"] == "cruise":
-            template_vars["current"]["text"] = cruise
-            template_vars["current"]["value"] = cruise
+    # Grafana template variable names are unique, stop at the first match
+    template_vars = next((t for t in dash["templating"]["list"] if t["name"] == "cruise"), None)
+    if template_vars is not None:
+        current = template_vars["current"]
+        current["text"] = current["value"] = cruise
 
 
 def replace_uid(dash: dict[Any, Any], uid: str):
     dash["uid"] = uid
 
 
+def parse_dash(data: bytes) -> dict[Any, Any]:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def serialize_dash(dash: dict[Any, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(dash)
+    return json.dumps(dash, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def read_dash(dash_file: Path) -> dict[Any, Any]:
+    return parse_dash(dash_file.read_bytes())
+
+
+def write_dash(dash: dict[Any, Any], dash_file: Path, compact: bool = False):
+    if compact:
+        dash_file.write_bytes(serialize_dash(dash))
+    elif orjson is not None:
+        dash_file.write_bytes(orjson.dumps(dash, option=orjson.OPT_INDENT_2))
+    else:
+        # JSON is UTF-8 by definition, don't depend on the locale encoding
+        with dash_file.open("wt", encoding="utf-8") as fh:
+            json.dump(dash, fh, indent=2, separators=(",", ": "), ensure_ascii=False)
+
+
 def get_cruise_from_underway_filename(fn: Path | str) -> str:
     fn = Path(fn)
     parts = fn.name.split(".")
@@ -58,28 +138,79 @@ def get_cruise_from_underway_filename(fn: Path | str) -> str:
     return cruise
 
 
-def template_dash(in_dash_file: Path | str, underway_file: Path | str, out_dir: Path | str):
-    in_dash_file = Path(in_dash_file)
-    underway_file = Path(underway_file)
-    out_dir = Path(out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
+def read_manifest(manifest_file: Path | str) -> list[tuple[int, str, str, str]]:
+    rows = []
+    with Path(manifest_file).open() as fh:
+        for i, line in enumerate(fh, start=1):
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            fields = line.split("\t")
+            if len(fields) != 3:
+                raise ValueError(f"expected 3 tab-separated fields on line {i} of {manifest_file}")
+            rows.append((i, fields[0], fields[1], fields[2]))
+    return rows
+
 
+def get_out_dash_file(template_name: str, cruise: str, out_dir: Path | str) -> Path:
     # Create output dash JSON file name. Assuming template JSON file is named
     # CRUISE-ByTime.json or CRUISE-Ops.json or some variant, replace CRUISE
     # with the actual cruise name and write the file to the output directory.
+    return Path(out_dir) / template_name.replace("CRUISE", cruise)
+
+
+def render_dash(dash: dict[Any, Any], template_name: str, underway_file: Path | str, out_dir: Path | str, compact: bool = False):
+    underway_file = Path(underway_file)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
     cruise = get_cruise_from_underway_filename(underway_file)
-    out_dash_file = Path(in_dash_file.name.replace("CRUISE", cruise))
-    out_dash_file = out_dir / out_dash_file
-    
-    with in_dash_file.open() as fh:
-        dash = json.load(fh)
+    out_dash_file = get_out_dash_file(template_name, cruise, out_dir)
+
     replace_time_range(dash, *read_date_range(underway_file))
     replace_cruise(dash, cruise)
     # Use the output dashboard JSON file name, without .json ext, as dashboard
     # UID.
     replace_uid(dash, out_dash_file.stem)
-    with Path(out_dash_file).open("wt") as fh:
-        fh.write(json.dumps(dash, indent=2))
+    write_dash(dash, out_dash_file, compact=compact)
+
+
+def template_dash(in_dash_file: Path | str, underway_file: Path | str, out_dir: Path | str, compact: bool = False):
+    in_dash_file = Path(in_dash_file)
+    render_dash(read_dash(in_dash_file), in_dash_file.name, underway_file, out_dir, compact=compact)
+
+
+def _render_one(task: tuple[bytes, str, str, str, bool]):
+    template_data, template_name, underway_file, out_dir, compact = task
+    render_dash(parse_dash(template_data), template_name, underway_file, out_dir, compact=compact)
+
+
+def template_dash_batch(manifest_file: Path | str, compact: bool = False, jobs: int | None = None):
+    # Each template is parsed once and handed to workers re-serialized as
+    # compact bytes, so a bad template fails before any work is started and
+    # workers parse a fresh copy per cruise from the smallest input.
+    templates = {}
+    tasks = []
+    out_lines = {}
+    for i, template_file, underway_file, out_dir in read_manifest(manifest_file):
+        in_dash_file = Path(template_file)
+        # Rows run concurrently, so two rows must never write the same file
+        cruise = get_cruise_from_underway_filename(underway_file)
+        out_dash_file = get_out_dash_file(in_dash_file.name, cruise, out_dir).resolve()
+        if out_dash_file in out_lines:
+            raise ValueError(
+                f"line {i} of {manifest_file} writes {out_dash_file}, already written by line {out_lines[out_dash_file]}"
+            )
+        out_lines[out_dash_file] = i
+        if in_dash_file not in templates:
+            templates[in_dash_file] = serialize_dash(read_dash(in_dash_file))
+        tasks.append((templates[in_dash_file], in_dash_file.name, underway_file, out_dir, compact))
+    if not tasks:
+        return
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        list(ex.map(_render_one, tasks, chunksize=chunksize))
 
 
 if __name__ == "__main__":
@@ -93,16 +224,29 @@ if __name__ == "__main__":
             the actual cruise name. e.g. If the template file is
             /dash/CRUISE-ByTime.json, the output UID would be
             CMOP_3-ByTime-realtime and the output file path would be
-            out_dir/CMOP_3-ByTime-realtime.json.
+            out_dir/CMOP_3-ByTime-realtime.json. With --batch, process every
+            template_file, underway_file, out_dir row of a tab-separated
+            manifest file in one run instead.
         """
     )
-    parser.add_argument("template_file", help="Template dashboard JSON file.")
-    parser.add_argument("underway_file", help="Underway TSDATA file with RFC3339 timestamps in the first column.")
-    parser.add_argument("out_dir", help="Output directory.")
+    parser.add_argument("template_file", nargs="?", help="Template dashboard JSON file.")
+    parser.add_argument("underway_file", nargs="?", help="Underway TSDATA file with RFC3339 timestamps in the first column.")
+    parser.add_argument("out_dir", nargs="?", help="Output directory.")
+    parser.add_argument("--batch", metavar="MANIFEST", help="Tab-separated file of template_file, underway_file, out_dir rows.")
+    parser.add_argument("--jobs", type=int, help="Worker processes for --batch. Defaults to the number of CPUs.")
+    parser.add_argument("--compact", action="store_true", help="Write compact JSON without indentation.")
     args = parser.parse_args()
+    positionals = (args.template_file, args.underway_file, args.out_dir)
+    if args.batch and any(positionals):
+        parser.error("--batch can't be combined with template_file, underway_file, out_dir")
+    if not args.batch and not all(positionals):
+        parser.error("template_file, underway_file, and out_dir are required without --batch")
     
     try:
-        template_dash(args.template_file, args.underway_file, args.out_dir)
+        if args.batch:
+            template_dash_batch(args.batch, compact=args.compact, jobs=args.jobs)
+        else:
+            template_dash(args.template_file, args.underway_file, args.out_dir, compact=args.compact)
     except Exception as e:
         print(f"Error templating dashboard file: {e}")
         sys.exit(1)
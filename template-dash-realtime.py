@@ -5,44 +5,128 @@ Fills in cruise time range, cruise name, and sets the dashboard UID to the
 cruise name.
 """
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import json
+import os
 import sys
 from typing import Any
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def replace_cruise(dash: dict[Any, Any], cruise):
     dash["title"] = dash["title"].replace("CRUISE", cruise)
-    for template_vars in dash["templating"]["list"]:
-        if template_vars["name"] == "cruise":
-            template_vars["current"]["text"] = cruise
-            template_vars["current"]["value"] = cruise
+    # Grafana template variable names are unique, stop at the first match
+    template_vars = next((t for t in dash["templating"]["list"] if t["name"] == "cruise"), None)
+    if template_vars is not None:
+        current = template_vars["current"]
+        current["text"] = current["value"] = cruise
 
 
 def replace_uid(dash: dict[Any, Any], uid: str):
     dash["uid"] = uid
 
 
-def template_dash(in_dash_file: Path | str, cruise: str, out_dir: Path | str):
-    in_dash_file = Path(in_dash_file)
-    out_dir = Path(out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
+def parse_dash(data: bytes) -> dict[Any, Any]:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def serialize_dash(dash: dict[Any, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(dash)
+    return json.dumps(dash, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def read_dash(dash_file: Path) -> dict[Any, Any]:
+    return parse_dash(dash_file.read_bytes())
+
+
+def write_dash(dash: dict[Any, Any], dash_file: Path, compact: bool = False):
+    if compact:
+        dash_file.write_bytes(serialize_dash(dash))
+    elif orjson is not None:
+        dash_file.write_bytes(orjson.dumps(dash, option=orjson.OPT_INDENT_2))
+    else:
+        # JSON is UTF-8 by definition, don't depend on the locale encoding
+        with dash_file.open("wt", encoding="utf-8") as fh:
+            json.dump(dash, fh, indent=2, separators=(",", ": "), ensure_ascii=False)
+
+
+def read_manifest(manifest_file: Path | str) -> list[tuple[int, str, str, str]]:
+    rows = []
+    with Path(manifest_file).open() as fh:
+        for i, line in enumerate(fh, start=1):
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            fields = line.split("\t")
+            if len(fields) != 3:
+                raise ValueError(f"expected 3 tab-separated fields on line {i} of {manifest_file}")
+            rows.append((i, fields[0], fields[1], fields[2]))
+    return rows
+
 
+def get_out_dash_file(template_name: str, cruise: str, out_dir: Path | str) -> Path:
     # Create output dash JSON file name. Assuming template JSON file is named
     # CRUISE-ByTime.json or CRUISE-Ops.json or some variant, replace CRUISE
     # with the actual cruise name and write the file to the output directory.
-    out_dash_file = Path(in_dash_file.name.replace("CRUISE", cruise))
-    out_dash_file = out_dir / out_dash_file
-    
-    with in_dash_file.open() as fh:
-        dash = json.load(fh)
+    return Path(out_dir) / template_name.replace("CRUISE", cruise)
+
+
+def render_dash(dash: dict[Any, Any], template_name: str, cruise: str, out_dir: Path | str, compact: bool = False):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    out_dash_file = get_out_dash_file(template_name, cruise, out_dir)
 
     replace_cruise(dash, cruise)
     # Use the output dashboard JSON file name, without .json ext, as dashboard
     # UID.
     replace_uid(dash, out_dash_file.stem)
-    with Path(out_dash_file).open("wt") as fh:
-        fh.write(json.dumps(dash, indent=2))
+    write_dash(dash, out_dash_file, compact=compact)
+
+
+def template_dash(in_dash_file: Path | str, cruise: str, out_dir: Path | str, compact: bool = False):
+    in_dash_file = Path(in_dash_file)
+    render_dash(read_dash(in_dash_file), in_dash_file.name, cruise, out_dir, compact=compact)
+
+
+def _render_one(task: tuple[bytes, str, str, str, bool]):
+    template_data, template_name, cruise, out_dir, compact = task
+    render_dash(parse_dash(template_data), template_name, cruise, out_dir, compact=compact)
+
+
+def template_dash_batch(manifest_file: Path | str, compact: bool = False, jobs: int | None = None):
+    # Each template is parsed once and handed to workers re-serialized as
+    # compact bytes, so a bad template fails before any work is started and
+    # workers parse a fresh copy per cruise from the smallest input.
+    templates = {}
+    tasks = []
+    out_lines = {}
+    for i, template_file, cruise, out_dir in read_manifest(manifest_file):
+        in_dash_file = Path(template_file)
+        # Rows run concurrently, so two rows must never write the same file
+        out_dash_file = get_out_dash_file(in_dash_file.name, cruise, out_dir).resolve()
+        if out_dash_file in out_lines:
+            raise ValueError(
+                f"line {i} of {manifest_file} writes {out_dash_file}, already written by line {out_lines[out_dash_file]}"
+            )
+        out_lines[out_dash_file] = i
+        if in_dash_file not in templates:
+            templates[in_dash_file] = serialize_dash(read_dash(in_dash_file))
+        tasks.append((templates[in_dash_file], in_dash_file.name, cruise, out_dir, compact))
+    if not tasks:
+        return
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        list(ex.map(_render_one, tasks, chunksize=chunksize))
 
 
 if __name__ == "__main__":
@@ -56,16 +140,29 @@ if __name__ == "__main__":
             replaced with the actual cruise name. e.g. If the template file is
             /dash/CRUISE-ByTime-Realtime.json, the output UID would be
             CMOP_3-ByTime-Realtime and the output file path would be
-            out_dir/CMOP_3-ByTime-Realtime.json.
+            out_dir/CMOP_3-ByTime-Realtime.json. With --batch, process every
+            template_file, cruise, out_dir row of a tab-separated manifest
+            file in one run instead.
         """
     )
-    parser.add_argument("template_file", help="Template dashboard JSON file.")
-    parser.add_argument("cruise", help="Cruise name.")
-    parser.add_argument("out_dir", help="Output directory.")
+    parser.add_argument("template_file", nargs="?", help="Template dashboard JSON file.")
+    parser.add_argument("cruise", nargs="?", help="Cruise name.")
+    parser.add_argument("out_dir", nargs="?", help="Output directory.")
+    parser.add_argument("--batch", metavar="MANIFEST", help="Tab-separated file of template_file, cruise, out_dir rows.")
+    parser.add_argument("--jobs", type=int, help="Worker processes for --batch. Defaults to the number of CPUs.")
+    parser.add_argument("--compact", action="store_true", help="Write compact JSON without indentation.")
     args = parser.parse_args()
+    positionals = (args.template_file, args.cruise, args.out_dir)
+    if args.batch and any(positionals):
+        parser.error("--batch can't be combined with template_file, cruise, out_dir")
+    if not args.batch and not all(positionals):
+        parser.error("template_file, cruise, and out_dir are required without --batch")
     
     try:
-        template_dash(args.template_file, args.cruise, args.out_dir)
+        if args.batch:
+            template_dash_batch(args.batch, compact=args.compact, jobs=args.jobs)
+        else:
+            template_dash(args.template_file, args.cruise, args.out_dir, compact=args.compact)
     except Exception as e:
         print(f"Error templating dashboard file: {e}")
         sys.exit(1)